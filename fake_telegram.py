@@ -0,0 +1,307 @@
+"""Локальный тестовый Bot API сервер для нагрузочного тестирования tripsbot.
+
+Сервер имитирует методы Telegram Bot API, которые использует бот (getMe, deleteWebhook,
+getUpdates, sendMessage, sendDocument), и прогоняет сценарий: множество сотрудников
+регистрируются, отправляют геопозицию и выбирают статус. Каждый сотрудник отправляет
+следующий апдейт только после ответа бота на предыдущий, задержка между апдейтом и
+ответом бота записывается. По завершении выводится отчёт: перцентили задержки,
+пропускная способность и количество исходящих вызовов по методам.
+
+Запуск:
+    python fake_telegram.py --employees 1000 --checkins 3 --db employees.db
+    API_BASE_URL=http://127.0.0.1:8081 API_TOKEN=123:fake ADMIN_ID=1 python tripsbot.py
+
+По умолчанию сотрудники и их командировки записываются прямо в базу бота, и сценарий
+состоит только из чек-инов. С --register сотрудники проходят регистрацию через бота;
+при этом бот определяет часовой пояс страны через внешний геокодер Nominatim, поэтому
+этот режим подходит только для небольшого числа сотрудников.
+"""
+import argparse
+import asyncio
+import logging
+import sqlite3
+import time
+from datetime import datetime, timedelta
+from collections import Counter
+
+from aiohttp import web
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+BOT_ID = 42
+COUNTRIES = ['Германия', 'Франция', 'Италия', 'Испания', 'Турция']
+# Координаты и часовые пояса, соответствующие странам из COUNTRIES
+LOCATIONS = [(52.52, 13.405), (48.8566, 2.3522), (41.9028, 12.4964), (40.4168, -3.7038), (41.0082, 28.9784)]
+TIMEZONES = ['Europe/Berlin', 'Europe/Paris', 'Europe/Rome', 'Europe/Madrid', 'Europe/Istanbul']
+
+
+class FakeTelegram:
+    """Хранит очередь апдейтов и фиксирует ответы бота."""
+
+    def __init__(self, reply_timeout=30):
+        self.reply_timeout = reply_timeout
+        self.updates = []
+        self.update_id = 0
+        self.message_id = 0
+        self.new_update = asyncio.Event()
+        self.bot_connected = asyncio.Event()
+        self.waiters = {}
+        self.outbound = Counter()
+        self.latencies = []
+        self.failures = 0
+
+    def next_message_id(self):
+        self.message_id += 1
+        return self.message_id
+
+    def bot_message(self, chat_id, text=None):
+        """Формирует объект Message, как его вернул бы Telegram."""
+        message = {
+            'message_id': self.next_message_id(),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': BOT_ID, 'is_bot': True, 'first_name': 'tripsbot'}
+        }
+        if text is not None:
+            message['text'] = text
+        return message
+
+    async def handle_method(self, request):
+        """Обрабатывает вызов метода Bot API."""
+        method = request.match_info['method']
+        params = dict(await request.post()) if request.can_read_body else {}
+        params.update(request.query)
+        self.outbound[method] += 1
+        result = await self.call(method, params)
+        return web.json_response({'ok': True, 'result': result})
+
+    async def call(self, method, params):
+        if method == 'getMe':
+            return {'id': BOT_ID, 'is_bot': True, 'first_name': 'tripsbot', 'username': 'tripsbot'}
+        if method in ('deleteWebhook', 'setWebhook', 'answerCallbackQuery'):
+            return True
+        if method == 'getUpdates':
+            self.bot_connected.set()
+            return await self.get_updates(params)
+        if method in ('sendMessage', 'sendDocument'):
+            chat_id = int(params['chat_id'])
+            self.resolve(chat_id)
+            message = self.bot_message(chat_id, params.get('text'))
+            if method == 'sendDocument':
+                message['document'] = {'file_id': str(message['message_id']), 'file_unique_id': str(message['message_id'])}
+            return message
+        logging.warning(f"Неподдерживаемый метод {method}")
+        return True
+
+    async def get_updates(self, params):
+        """Long polling: отдаёт апдейты начиная с offset или ждёт до timeout секунд."""
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        timeout = int(params.get('timeout') or 0)
+        self.updates = [u for u in self.updates if u['update_id'] >= offset]
+        if not self.updates and timeout:
+            self.new_update.clear()
+            try:
+                await asyncio.wait_for(self.new_update.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[:limit]
+
+    def resolve(self, chat_id):
+        """Засчитывает ответ бота сотруднику, ожидающему его."""
+        waiter = self.waiters.pop(chat_id, None)
+        if waiter and not waiter.done():
+            waiter.set_result(time.perf_counter())
+
+    async def send_update(self, chat_id, payload):
+        """Передаёт апдейт боту и ждёт ответа. Возвращает задержку в секундах или None."""
+        self.update_id += 1
+        update = {'update_id': self.update_id, **payload}
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters[chat_id] = waiter
+        started = time.perf_counter()
+        self.updates.append(update)
+        self.new_update.set()
+        try:
+            finished = await asyncio.wait_for(waiter, self.reply_timeout)
+        except asyncio.TimeoutError:
+            self.waiters.pop(chat_id, None)
+            self.failures += 1
+            logging.warning(f"Бот не ответил пользователю {chat_id} за {self.reply_timeout} с")
+            return None
+        latency = finished - started
+        self.latencies.append(latency)
+        return latency
+
+
+def user_object(user_id):
+    return {'id': user_id, 'is_bot': False, 'first_name': f"Сотрудник {user_id}", 'username': f"employee{user_id}"}
+
+
+def message_update(fake, user_id, **content):
+    message = {
+        'message_id': fake.next_message_id(),
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': user_object(user_id),
+        **content
+    }
+    return {'message': message}
+
+
+def command_update(fake, user_id, command):
+    return message_update(fake, user_id, text=command,
+                          entities=[{'type': 'bot_command', 'offset': 0, 'length': len(command)}])
+
+
+def callback_update(fake, user_id, data):
+    return {'callback_query': {
+        'id': str(fake.next_message_id()),
+        'from': user_object(user_id),
+        'chat_instance': str(user_id),
+        'message': fake.bot_message(user_id, "..."),
+        'data': data
+    }}
+
+
+def clear_employees(conn, user_ids):
+    """Удаляет имитируемых сотрудников прошлых запусков, чтобы сценарий можно было повторить."""
+    conn.executemany('DELETE FROM trips WHERE user_id = ?', ((user_id,) for user_id in user_ids))
+    conn.executemany('DELETE FROM employees WHERE user_id = ?', ((user_id,) for user_id in user_ids))
+
+
+def reset_employees(db_path, first_user_id, count):
+    """Готовит базу к сценарию с регистрацией: сотрудники должны быть незарегистрированы."""
+    conn = sqlite3.connect(db_path)
+    try:
+        clear_employees(conn, range(first_user_id, first_user_id + count))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def seed_employees(db_path, first_user_id, count):
+    """Записывает сотрудников и их текущие командировки прямо в базу бота, минуя регистрацию."""
+    today = datetime.now()
+    start_date = today.strftime('%Y-%m-%d')
+    end_date = (today + timedelta(days=7)).strftime('%Y-%m-%d')
+    user_ids = range(first_user_id, first_user_id + count)
+    conn = sqlite3.connect(db_path)
+    try:
+        clear_employees(conn, user_ids)
+        conn.executemany(
+            'INSERT INTO employees (user_id, name, username, archived) VALUES (?, ?, ?, 0)',
+            ((user_id, f"Сотрудник {index}", f"employee{user_id}") for index, user_id in enumerate(user_ids))
+        )
+        conn.executemany('''
+            INSERT INTO trips (user_id, country, timezone, start_date, end_date, checkin_frequency, checkin_time)
+            VALUES (?, ?, ?, ?, ?, 1, 'morning')
+        ''', ((user_id, COUNTRIES[index % len(COUNTRIES)], TIMEZONES[index % len(TIMEZONES)], start_date, end_date)
+              for index, user_id in enumerate(user_ids)))
+        conn.commit()
+    finally:
+        conn.close()
+    print(f"В базу {db_path} записано сотрудников: {count}")
+
+
+def employee_script(fake, user_id, index, checkins, register=True):
+    """Генерирует апдейты одного сотрудника: регистрация (если нужна) и серия чек-инов."""
+    latitude, longitude = LOCATIONS[index % len(LOCATIONS)]
+    if register:
+        yield from registration_script(fake, user_id, index)
+    for _ in range(checkins):
+        yield message_update(fake, user_id, location={'latitude': latitude, 'longitude': longitude})
+        yield callback_update(fake, user_id, 'status_ok')
+
+
+def registration_script(fake, user_id, index):
+    today = datetime.now()
+    country = COUNTRIES[index % len(COUNTRIES)]
+    yield command_update(fake, user_id, '/start')
+    yield message_update(fake, user_id, text=f"Сотрудник {index}")
+    yield message_update(fake, user_id, text=country)
+    yield message_update(fake, user_id, text=today.strftime('%d/%m/%Y'))
+    yield message_update(fake, user_id, text=(today + timedelta(days=7)).strftime('%d/%m/%Y'))
+    yield callback_update(fake, user_id, 'freq_1')
+    yield callback_update(fake, user_id, 'time_morning')
+    yield callback_update(fake, user_id, 'finish')
+
+
+async def run_employee(fake, user_id, index, checkins, think_time, register):
+    for payload in employee_script(fake, user_id, index, checkins, register):
+        if await fake.send_update(user_id, payload) is None:
+            return
+        if think_time:
+            await asyncio.sleep(think_time)
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def print_report(fake, duration):
+    latencies_ms = [latency * 1000 for latency in fake.latencies]
+    print(f"Обработано апдейтов: {len(fake.latencies)}, без ответа: {fake.failures}")
+    print(f"Длительность: {duration:.1f} с, пропускная способность: {len(fake.latencies) / duration:.1f} апдейтов/с")
+    print("Задержка, мс: " + ", ".join(
+        f"p{p}={percentile(latencies_ms, p):.1f}" for p in (50, 90, 95, 99)
+    ) + f", max={max(latencies_ms, default=0):.1f}")
+    print("Исходящие вызовы бота:")
+    for method, count in sorted(fake.outbound.items()):
+        print(f"  {method}: {count}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Тестовый Bot API сервер для нагрузочного тестирования tripsbot")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--employees', type=int, default=100, help="число имитируемых сотрудников")
+    parser.add_argument('--checkins', type=int, default=3, help="число чек-инов на сотрудника")
+    parser.add_argument('--concurrency', type=int, default=100, help="сколько сотрудников действуют одновременно")
+    parser.add_argument('--think-time', type=float, default=0, help="пауза между действиями сотрудника, с")
+    parser.add_argument('--reply-timeout', type=float, default=30, help="сколько ждать ответа бота, с")
+    parser.add_argument('--first-user-id', type=int, default=1000000)
+    parser.add_argument('--db', default='employees.db', help="путь к базе данных бота")
+    parser.add_argument('--register', action='store_true',
+                        help="проходить регистрацию через бота (бот обращается к Nominatim)")
+    args = parser.parse_args()
+
+    fake = FakeTelegram(reply_timeout=args.reply_timeout)
+    app = web.Application()
+    app.router.add_route('*', '/bot{token}/{method}', fake.handle_method)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, args.host, args.port).start()
+    print(f"Тестовый Bot API запущен на http://{args.host}:{args.port}")
+
+    try:
+        print("Ожидание подключения бота...")
+        await fake.bot_connected.wait()
+        # К этому моменту бот уже создал таблицы в своей базе
+        if args.register:
+            reset_employees(args.db, args.first_user_id, args.employees)
+        else:
+            seed_employees(args.db, args.first_user_id, args.employees)
+
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def limited(index):
+            async with semaphore:
+                await run_employee(fake, args.first_user_id + index, index, args.checkins, args.think_time, args.register)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(limited(i) for i in range(args.employees)))
+        print_report(fake, time.perf_counter() - started)
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -2,12 +2,24 @@ import asyncio
 import logging
 import sqlite3
 import csv
+import gzip
+import marshal
+import math
+import pstats
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
 from io import StringIO
 from datetime import datetime, timedelta
-from aiogram import Bot, Dispatcher
-from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton, Message, CallbackQuery, BufferedInputFile, ContentType
+from aiogram import Bot, Dispatcher, BaseMiddleware
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton, Message, CallbackQuery, BufferedInputFile, FSInputFile, ContentType
 from aiogram.filters import Command, CommandStart, BaseFilter
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.fsm.storage.memory import MemoryStorage, SimpleEventIsolation
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 import pycountry
@@ -29,22 +41,115 @@ logging.basicConfig(
 load_dotenv()
 API_TOKEN = os.getenv('API_TOKEN')
 ADMIN_ID = int(os.getenv('ADMIN_ID') or 0)
+# Адрес Bot API (например, локального тестового сервера fake_telegram.py)
+API_BASE_URL = os.getenv('API_BASE_URL')
+# Ограничения на параллельную обработку апдейтов
+MAX_CONCURRENT_HANDLERS = int(os.getenv('MAX_CONCURRENT_HANDLERS') or 20)
+MAX_PENDING_UPDATES = int(os.getenv('MAX_PENDING_UPDATES') or 200)
+# Отслеживание трансляции геопозиции (live location), по умолчанию выключено
+LIVE_TRACKING = os.getenv('LIVE_TRACKING', '0') == '1'
+LIVE_MIN_DISTANCE = float(os.getenv('LIVE_MIN_DISTANCE') or 50)  # метры
+LIVE_MIN_INTERVAL = int(os.getenv('LIVE_MIN_INTERVAL') or 300)  # секунды
+LIVE_SIMPLIFY_EPSILON = float(os.getenv('LIVE_SIMPLIFY_EPSILON') or 20)  # метры
+LIVE_FLUSH_POINTS = int(os.getenv('LIVE_FLUSH_POINTS') or 50)
+LIVE_FLUSH_INTERVAL = int(os.getenv('LIVE_FLUSH_INTERVAL') or 300)  # секунды
+# Резервное копирование базы данных
+DB_PATH = 'employees.db'
+BACKUP_DIR = os.getenv('BACKUP_DIR') or 'backups'
+BACKUP_INTERVAL = int(os.getenv('BACKUP_INTERVAL') or 24)  # часы, 0 — отключить
+BACKUP_KEEP = int(os.getenv('BACKUP_KEEP') or 7)
 if not API_TOKEN or not ADMIN_ID:
     logging.error("API_TOKEN или ADMIN_ID не заданы!")
     raise ValueError("Необходимо задать API_TOKEN и ADMIN_ID в .env файле")
+if MAX_CONCURRENT_HANDLERS < 1 or MAX_PENDING_UPDATES < 1:
+    logging.error(f"Некорректные MAX_CONCURRENT_HANDLERS ({MAX_CONCURRENT_HANDLERS}) или MAX_PENDING_UPDATES ({MAX_PENDING_UPDATES})")
+    raise ValueError("MAX_CONCURRENT_HANDLERS и MAX_PENDING_UPDATES должны быть не меньше 1")
+if BACKUP_KEEP < 1:
+    logging.error(f"Некорректное значение BACKUP_KEEP: {BACKUP_KEEP}")
+    raise ValueError("BACKUP_KEEP должен быть не меньше 1")
 
 # Инициализация бота и диспетчера
-bot = Bot(token=API_TOKEN)
+if API_BASE_URL:
+    bot = Bot(token=API_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(API_BASE_URL)))
+    logging.info(f"Используется Bot API по адресу {API_BASE_URL}")
+else:
+    bot = Bot(token=API_TOKEN)
 storage = MemoryStorage()
 try:
-    dp = Dispatcher(storage=storage)
+    # Апдейты одного пользователя обрабатываются по очереди, разных пользователей — параллельно
+    dp = Dispatcher(storage=storage, events_isolation=SimpleEventIsolation())
 except Exception as e:
     logging.error(f"Ошибка при инициализации Dispatcher: {e}")
     raise
 
+class ConcurrencyLimitMiddleware(BaseMiddleware):
+    """Ограничивает число одновременно выполняющихся обработчиков."""
+    def __init__(self, max_concurrent):
+        self.semaphore = asyncio.Semaphore(max_concurrent)
+
+    async def __call__(self, handler, event, data):
+        async with self.semaphore:
+            return await handler(event, data)
+
+dp.update.outer_middleware(ConcurrencyLimitMiddleware(MAX_CONCURRENT_HANDLERS))
+
+# Статистика SQL-запросов во время профилирования: запрос -> [количество, суммарное время, максимум]
+sql_profile = None
+
+class TimedCursor(sqlite3.Cursor):
+    """Курсор, замеряющий время SQL-запросов, пока включено профилирование.
+
+    Время запроса — это выполнение вместе со всеми выборками его результатов. Запрос
+    попадает в статистику при следующем execute или при вызове finish_timing.
+    """
+    # [запрос, накопленное время] для текущего запроса
+    pending = None
+
+    def execute(self, sql, parameters=()):
+        self.finish_timing()
+        if sql_profile is None:
+            return super().execute(sql, parameters)
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self.pending = [' '.join(sql.split()), time.perf_counter() - started]
+
+    def fetchone(self):
+        return self.timed_fetch(super().fetchone)
+
+    def fetchall(self):
+        return self.timed_fetch(super().fetchall)
+
+    def timed_fetch(self, fetch):
+        if self.pending is None:
+            return fetch()
+        started = time.perf_counter()
+        try:
+            return fetch()
+        finally:
+            self.pending[1] += time.perf_counter() - started
+
+    def finish_timing(self):
+        """Записывает время текущего запроса в статистику профилирования."""
+        if self.pending is not None:
+            record_sql(*self.pending)
+            self.pending = None
+
+def record_sql(sql, elapsed):
+    """Добавляет время выполнения запроса в статистику профилирования."""
+    if sql_profile is None:
+        return
+    stats = sql_profile.setdefault(sql, [0, 0.0, 0.0])
+    stats[0] += 1
+    stats[1] += elapsed
+    stats[2] = max(stats[2], elapsed)
+
 # Инициализация базы данных
-conn = sqlite3.connect('employees.db')
-cursor = conn.cursor()
+conn = sqlite3.connect(DB_PATH)
+cursor = conn.cursor(factory=TimedCursor)
+# WAL: чтение для бэкапа не блокирует запись чек-инов, а запись не прерывает бэкап
+cursor.execute('PRAGMA journal_mode=WAL')
 cursor.execute('''
     CREATE TABLE IF NOT EXISTS employees (
         user_id INTEGER PRIMARY KEY,
@@ -75,9 +180,21 @@ cursor.execute('''
         timestamp TEXT
     )
 ''')
+cursor.execute('''
+    CREATE TABLE IF NOT EXISTS tracks (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        trip_id INTEGER,
+        start_ts TEXT,
+        end_ts TEXT,
+        point_count INTEGER,
+        points BLOB
+    )
+''')
 # Создание индексов для оптимизации запросов
 cursor.execute('CREATE INDEX IF NOT EXISTS idx_trips_user_id ON trips(user_id)')
 cursor.execute('CREATE INDEX IF NOT EXISTS idx_checkins_user_id ON checkins(user_id)')
+cursor.execute('CREATE INDEX IF NOT EXISTS idx_tracks_user_id ON tracks(user_id)')
 conn.commit()
 
 # Клавиатуры
@@ -139,6 +256,16 @@ class Registration(StatesGroup):
 # Словарь для отслеживания отправленных напоминаний
 reminders_sent = {}
 
+# Буферы трансляций геопозиции: user_id -> {'points': [(lat, lon, ts), ...], 'last': (lat, lon, ts),
+# 'carried': последняя точка предыдущего сегмента, с которой начинается буфер}
+live_tracks = {}
+# Время последней точки трансляции по пользователям (datetime с часовым поясом)
+live_last_seen = {}
+
+# Окно, в котором чек-ин засчитывается, относительно ожидаемого времени
+CHECKIN_WINDOW_BEFORE = timedelta(minutes=90)
+CHECKIN_WINDOW_AFTER = timedelta(minutes=20)
+
 def get_timezone_by_country(country_name):
     """Получает часовой пояс по названию страны с использованием geopy."""
     try:
@@ -181,6 +308,82 @@ def format_time_ago(timestamp, tz):
         logging.error(f"Ошибка при форматировании времени: {e}")
         return "неизвестно"
 
+def utc_isoformat(moment):
+    """Переводит datetime с часовым поясом в строку UTC, сравнимую с другими такими строками."""
+    return moment.astimezone(timezone('UTC')).isoformat(timespec='seconds')
+
+def distance_m(lat1, lon1, lat2, lon2):
+    """Расстояние между двумя точками в метрах (формула гаверсинусов)."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * 6371000 * math.asin(math.sqrt(a))
+
+def simplify_track(points, epsilon):
+    """Упрощает трек алгоритмом Рамера — Дугласа — Пекера с допуском epsilon метров."""
+    if len(points) < 3:
+        return list(points)
+    # Локальная проекция в метры относительно первой точки
+    lat0 = math.radians(points[0][0])
+    xy = [(math.radians(lon) * math.cos(lat0) * 6371000, math.radians(lat) * 6371000) for lat, lon, _ in points]
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        (x1, y1), (x2, y2) = xy[first], xy[last]
+        length = math.hypot(x2 - x1, y2 - y1)
+        max_dist, index = 0.0, None
+        for i in range(first + 1, last):
+            x, y = xy[i]
+            if length:
+                dist = abs((x2 - x1) * (y1 - y) - (x1 - x) * (y2 - y1)) / length
+            else:
+                dist = math.hypot(x - x1, y - y1)
+            if dist > max_dist:
+                max_dist, index = dist, i
+        if index is not None and max_dist > epsilon:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [point for point, kept in zip(points, keep) if kept]
+
+def encode_track(points):
+    """Кодирует точки (lat, lon, ts) в компактный вид: дельты в zigzag-varint."""
+    output = bytearray()
+    previous = (0, 0, 0)
+    for lat, lon, ts in points:
+        current = (round(lat * 1e5), round(lon * 1e5), int(ts))
+        for value, prev in zip(current, previous):
+            delta = value - prev
+            delta = (delta << 1) ^ (delta >> 63)
+            while delta >= 0x80:
+                output.append((delta & 0x7f) | 0x80)
+                delta >>= 7
+            output.append(delta)
+        previous = current
+    return bytes(output)
+
+def decode_track(data):
+    """Декодирует трек, закодированный encode_track."""
+    values = []
+    value, shift = 0, 0
+    for byte in data:
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            values.append((value >> 1) ^ -(value & 1))
+            value, shift = 0, 0
+    points = []
+    lat = lon = ts = 0
+    for i in range(0, len(values) - 2, 3):
+        lat += values[i]
+        lon += values[i + 1]
+        ts += values[i + 2]
+        points.append((lat / 1e5, lon / 1e5, ts))
+    return points
+
 @dp.message(CommandStart())
 async def start_command(message: Message, state: FSMContext):
     """Обрабатывает команду /start и инициирует регистрацию или предлагает новую командировку."""
@@ -452,10 +655,68 @@ async def handle_location(message: Message, state: FSMContext):
     ''', (timezone_str, user_id, current_date))
     conn.commit()
 
+    if LIVE_TRACKING and location.live_period:
+        add_live_point(user_id, location.latitude, location.longitude)
+
     await state.update_data(latitude=location.latitude, longitude=location.longitude)
     await message.reply("Геопозиция получена. Выберите статус:", reply_markup=status_keyboard)
     logging.info(f"Геопозиция получена от {user_id}: ({location.latitude}, {location.longitude}), часовой пояс: {timezone_str}")
 
+def add_live_point(user_id, latitude, longitude):
+    """Добавляет точку трансляции в буфер, отбрасывая слишком близкие и частые точки."""
+    now = time.time()
+    live_last_seen[user_id] = datetime.now(timezone('UTC'))
+    track = live_tracks.setdefault(user_id, {'points': [], 'last': None, 'carried': None})
+    last = track['last']
+    if last:
+        moved = distance_m(last[0], last[1], latitude, longitude)
+        if moved < LIVE_MIN_DISTANCE and now - last[2] < LIVE_MIN_INTERVAL:
+            return
+    point = (latitude, longitude, now)
+    track['points'].append(point)
+    track['last'] = point
+    if len(track['points']) >= LIVE_FLUSH_POINTS:
+        flush_live_track(user_id)
+
+def flush_live_track(user_id):
+    """Упрощает накопленные точки трансляции и сохраняет их одним сегментом трека."""
+    track = live_tracks.get(user_id)
+    if not track or not track['points'] or track['points'] == [track['carried']]:
+        return
+    points = simplify_track(track['points'], LIVE_SIMPLIFY_EPSILON)
+    # Следующий сегмент начинается с последней точки этого, чтобы в треке не было разрывов
+    track['points'] = [points[-1]]
+    track['carried'] = points[-1]
+    try:
+        cursor.execute('SELECT id FROM trips WHERE user_id = ? AND date("now") BETWEEN start_date AND end_date', (user_id,))
+        trip = cursor.fetchone()
+        cursor.execute('''
+            INSERT INTO tracks (user_id, trip_id, start_ts, end_ts, point_count, points)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (user_id, trip[0] if trip else None,
+              utc_isoformat(datetime.fromtimestamp(points[0][2], timezone('UTC'))),
+              utc_isoformat(datetime.fromtimestamp(points[-1][2], timezone('UTC'))),
+              len(points), encode_track(points)))
+        conn.commit()
+        logging.info(f"Сохранён сегмент трека для {user_id}: {len(points)} точек")
+    except Exception as e:
+        logging.error(f"Ошибка при сохранении трека для {user_id}: {e}")
+
+async def handle_live_location(message: Message):
+    """Обрабатывает обновления трансляции геопозиции (изменённые сообщения)."""
+    user_id = message.from_user.id
+    if user_id not in live_tracks:
+        cursor.execute('SELECT 1 FROM employees WHERE user_id = ?', (user_id,))
+        if not cursor.fetchone():
+            return
+    location = message.location
+    if not (-90 <= location.latitude <= 90 and -180 <= location.longitude <= 180):
+        return
+    add_live_point(user_id, location.latitude, location.longitude)
+
+if LIVE_TRACKING:
+    dp.edited_message.register(handle_live_location, LocationFilter())
+
 @dp.callback_query(lambda c: c.data.startswith('status_'))
 async def handle_status(callback: CallbackQuery, state: FSMContext):
     """Обрабатывает выбор статуса чек-ина."""
@@ -470,6 +731,9 @@ async def handle_status(callback: CallbackQuery, state: FSMContext):
     state_data = await state.get_data()
     latitude = state_data.get('latitude')
     longitude = state_data.get('longitude')
+    if latitude is None or longitude is None:
+        await callback.message.reply("Сначала отправьте геопозицию.", reply_markup=keyboard)
+        return
     timestamp = datetime.now().isoformat()
 
     try:
@@ -478,6 +742,8 @@ async def handle_status(callback: CallbackQuery, state: FSMContext):
             VALUES (?, ?, ?, ?, ?)
         ''', (user_id, latitude, longitude, status, timestamp))
         conn.commit()
+        # Геопозиция использована, повторное нажатие не создаст дубликат чек-ина
+        await state.update_data(latitude=None, longitude=None)
         maps_url = f"https://www.google.com/maps?q={latitude},{longitude}"
         await callback.message.reply(f"Чек-ин зарегистрирован: {status}\nКарта: {maps_url}")
         logging.info(f"Чек-ин зарегистрирован для {user_id}: {status}")
@@ -651,6 +917,219 @@ async def export_checkins(message: Message):
         logging.error(f"Ошибка при экспорте чек-инов: {e}")
         await message.reply("Произошла ошибка при экспорте чек-инов.")
 
+# Интервал между выборками стека при профилировании, секунды
+PROFILE_INTERVAL = 0.005
+
+def sample_stacks(thread_id, stop_event, interval, samples):
+    """Периодически снимает стек потока и считает, сколько раз встретился каждый стек."""
+    while not stop_event.wait(interval):
+        frame = sys._current_frames().get(thread_id)
+        stack = []
+        while frame:
+            code = frame.f_code
+            stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+            frame = frame.f_back
+        if stack:
+            samples[tuple(reversed(stack))] += 1
+
+def build_sampled_stats(samples, interval):
+    """Строит статистику в формате pstats по выборкам стеков.
+
+    Время оценивается как число выборок, умноженное на интервал; вместо числа вызовов
+    указывается число выборок.
+    """
+    stats = {}
+    for stack, count in samples.items():
+        elapsed = count * interval
+        seen = set()
+        for depth, func in enumerate(stack):
+            cc, nc, tt, ct, callers = stats.get(func, (0, 0, 0.0, 0.0, {}))
+            is_leaf = depth == len(stack) - 1
+            nc += count
+            # При рекурсии время функции учитывается один раз на выборку
+            if func not in seen:
+                seen.add(func)
+                cc += count
+                ct += elapsed
+            if is_leaf:
+                tt += elapsed
+            if depth:
+                caller = stack[depth - 1]
+                c_cc, c_nc, c_tt, c_ct = callers.get(caller, (0, 0, 0.0, 0.0))
+                callers[caller] = (c_cc + count, c_nc + count, c_tt + (elapsed if is_leaf else 0.0), c_ct + elapsed)
+            stats[func] = (cc, nc, tt, ct, callers)
+    return stats
+
+class SampledProfile:
+    """Результат выборочного профилирования, пригодный для pstats.Stats."""
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+async def run_profile(chat_id, seconds):
+    """Профилирует бота заданное время и отправляет результаты админу."""
+    global sql_profile
+    samples = Counter()
+    stop_event = threading.Event()
+    sampler = threading.Thread(
+        target=sample_stacks,
+        args=(threading.get_ident(), stop_event, PROFILE_INTERVAL, samples),
+        daemon=True
+    )
+    sql_profile = {}
+    try:
+        sampler.start()
+    except Exception as e:
+        sql_profile = None
+        logging.error(f"Ошибка при запуске профилирования: {e}")
+        await bot.send_message(chat_id, "Не удалось запустить профилирование.")
+        return
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        stop_event.set()
+        sampler.join()
+        cursor.finish_timing()
+        sql_stats, sql_profile = sql_profile, None
+
+    try:
+        profile = SampledProfile(build_sampled_stats(samples, PROFILE_INTERVAL))
+        pstats_data = marshal.dumps(profile.stats)
+        summary = StringIO()
+        pstats.Stats(profile, stream=summary).sort_stats('cumulative').print_stats(20)
+        collapsed = "\n".join(
+            ';'.join(f"{name} ({os.path.basename(filename)}:{lineno})" for filename, lineno, name in stack) + f" {count}"
+            for stack, count in samples.most_common()
+        )
+
+        slowest = sorted(sql_stats.items(), key=lambda item: item[1][2], reverse=True)[:10]
+        sql_report = "Самые медленные SQL-запросы, выполнение и выборка (макс / сумма / количество):\n"
+        for sql, (count, total, worst) in slowest:
+            sql_report += f"{worst * 1000:.2f} мс / {total * 1000:.2f} мс / {count}: {sql[:200]}\n"
+        if not slowest:
+            sql_report += "SQL-запросы не выполнялись.\n"
+
+        await bot.send_document(chat_id, BufferedInputFile(pstats_data, filename='profile.pstats'),
+                                caption=f"Профиль за {seconds} с (pstats, по выборкам стека)")
+        await bot.send_document(chat_id, BufferedInputFile(summary.getvalue().encode('utf-8'), filename='profile.txt'),
+                                caption="Сводка по функциям")
+        await bot.send_document(chat_id, BufferedInputFile(collapsed.encode('utf-8'), filename='profile.collapsed'),
+                                caption=f"Свёрнутые стеки для flamegraph ({sum(samples.values())} выборок)")
+        await bot.send_message(chat_id, sql_report[:4096])
+        logging.info(f"Профилирование за {seconds} с завершено")
+    except Exception as e:
+        logging.error(f"Ошибка при отправке результатов профилирования: {e}")
+        await bot.send_message(chat_id, "Произошла ошибка при отправке результатов профилирования.")
+
+@dp.message(Command("profile"))
+async def profile_command(message: Message):
+    """Запускает профилирование на заданное число секунд (для админа)."""
+    if message.from_user.id != ADMIN_ID:
+        return
+    args = message.text.split()
+    try:
+        seconds = int(args[1]) if len(args) > 1 else 30
+    except ValueError:
+        await message.reply("Использование: /profile <секунды>")
+        return
+    if not 1 <= seconds <= 600:
+        await message.reply("Длительность профилирования должна быть от 1 до 600 секунд.")
+        return
+    if sql_profile is not None:
+        await message.reply("Профилирование уже запущено.")
+        return
+    # Профилирование идёт в отдельной задаче, чтобы не блокировать очередь апдейтов админа
+    asyncio.create_task(run_profile(message.chat.id, seconds))
+    await message.reply(f"Профилирование запущено на {seconds} с.")
+    logging.info(f"Админ запустил профилирование на {seconds} с")
+
+# Не допускает одновременного запуска нескольких бэкапов
+backup_lock = asyncio.Lock()
+
+def make_backup():
+    """Создаёт сжатый снимок базы через VACUUM INTO. Выполняется в отдельном потоке."""
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    name = f"employees-{datetime.now().strftime('%Y%m%d-%H%M%S')}.db"
+    snapshot_path = os.path.join(BACKUP_DIR, name + '.tmp')
+    archive_path = os.path.join(BACKUP_DIR, name + '.gz')
+    part_path = archive_path + '.part'
+    # Отдельное соединение: основное принадлежит потоку event loop.
+    # VACUUM INTO читает базу одной транзакцией, поэтому снимок согласован,
+    # а в режиме WAL параллельные коммиты бота его не блокируют и не перезапускают
+    source = sqlite3.connect(DB_PATH)
+    try:
+        source.execute('VACUUM INTO ?', (snapshot_path,))
+        with open(snapshot_path, 'rb') as src, gzip.open(part_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(part_path, archive_path)
+    finally:
+        source.close()
+        # Удаляем промежуточные файлы, в том числе после ошибки
+        for leftover in (snapshot_path, part_path):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+    # Ротация: оставляем BACKUP_KEEP последних снимков
+    snapshots = sorted(f for f in os.listdir(BACKUP_DIR) if f.startswith('employees-') and f.endswith('.db.gz'))
+    for old in snapshots[:-BACKUP_KEEP]:
+        os.remove(os.path.join(BACKUP_DIR, old))
+    return archive_path
+
+def restore_backup(path):
+    """Восстанавливает базу из снимка. Бот при этом должен быть остановлен."""
+    tmp_path = None
+    try:
+        with tempfile.NamedTemporaryFile(suffix='.db', delete=False) as tmp:
+            tmp_path = tmp.name
+            opener = gzip.open if path.endswith('.gz') else open
+            with opener(path, 'rb') as src:
+                shutil.copyfileobj(src, tmp)
+        source = sqlite3.connect(tmp_path)
+        try:
+            source.backup(conn)
+        finally:
+            source.close()
+    finally:
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    logging.info(f"База данных восстановлена из {path}")
+
+async def run_backup():
+    """Запускает бэкап в отдельном потоке, не блокируя обработку апдейтов."""
+    async with backup_lock:
+        path = await asyncio.to_thread(make_backup)
+    logging.info(f"Создан бэкап базы данных: {path}")
+    return path
+
+@dp.message(Command("backup"))
+async def backup_command(message: Message):
+    """Создаёт бэкап базы и отправляет его админу."""
+    if message.from_user.id != ADMIN_ID:
+        return
+    try:
+        path = await run_backup()
+    except Exception as e:
+        logging.error(f"Ошибка при создании бэкапа: {e}")
+        await message.reply("Произошла ошибка при создании бэкапа.")
+        return
+    try:
+        await message.reply_document(FSInputFile(path), caption=f"Бэкап базы данных: {os.path.basename(path)}")
+    except Exception as e:
+        # Например, снимок больше лимита Telegram на размер файла
+        logging.error(f"Ошибка при отправке бэкапа {path}: {e}")
+        await message.reply(f"Бэкап создан, но отправить его не удалось. Файл сохранён на сервере: {path}")
+
+async def backup_employees_db():
+    """Периодически создаёт бэкапы базы данных."""
+    while True:
+        await asyncio.sleep(BACKUP_INTERVAL * 3600)
+        try:
+            await run_backup()
+        except Exception as e:
+            logging.error(f"Ошибка при плановом бэкапе: {e}")
+
 async def send_reminder(user_id, tz, checkin_time):
     """Отправляет напоминание о необходимости чек-ина."""
     reminder_time = checkin_time - timedelta(minutes=30)
@@ -722,8 +1201,21 @@ async def check_employees():
                     await send_reminder(user_id, tz, expected_time)
 
                     # Проверяем чек-ины в окне: -90 минут до +20 минут от ожидаемого времени
-                    window_start = (expected_time - timedelta(minutes=90)).isoformat()
-                    window_end = (expected_time + timedelta(minutes=20)).isoformat()
+                    window_start = (expected_time - CHECKIN_WINDOW_BEFORE).isoformat()
+                    window_end = (expected_time + CHECKIN_WINDOW_AFTER).isoformat()
+
+                    # Свежая точка трансляции геопозиции засчитывается как чек-ин.
+                    # Время трансляций хранится в UTC, поэтому сравнение не зависит от пояса сервера
+                    live_timestamp = live_last_seen.get(user_id)
+                    if live_timestamp and expected_time - CHECKIN_WINDOW_BEFORE <= live_timestamp <= expected_time + CHECKIN_WINDOW_AFTER:
+                        continue
+                    if LIVE_TRACKING:
+                        cursor.execute('SELECT 1 FROM tracks WHERE user_id = ? AND end_ts >= ? AND start_ts <= ?',
+                                      (user_id, utc_isoformat(expected_time - CHECKIN_WINDOW_BEFORE),
+                                       utc_isoformat(expected_time + CHECKIN_WINDOW_AFTER)))
+                        if cursor.fetchone():
+                            continue
+
                     cursor.execute('SELECT timestamp FROM checkins WHERE user_id = ? AND timestamp BETWEEN ? AND ?',
                                   (user_id, window_start, window_end))
                     checkin_in_window = cursor.fetchone()
@@ -757,15 +1249,41 @@ async def check_employees():
             logging.error(f"Ошибка в check_employees: {e}")
         await asyncio.sleep(1800)
 
+async def flush_live_tracks():
+    """Периодически сохраняет накопленные точки трансляций геопозиции и забывает завершённые трансляции."""
+    while True:
+        await asyncio.sleep(LIVE_FLUSH_INTERVAL)
+        # Точка старше окна чек-ина уже не может засчитаться как чек-ин
+        stale_before = datetime.now(timezone('UTC')) - CHECKIN_WINDOW_BEFORE - CHECKIN_WINDOW_AFTER
+        for user_id in list(live_tracks):
+            flush_live_track(user_id)
+            last_seen = live_last_seen.get(user_id)
+            if not last_seen or last_seen < stale_before:
+                live_tracks.pop(user_id, None)
+                live_last_seen.pop(user_id, None)
+
 async def main():
     """Основная функция запуска бота."""
     try:
         await bot.delete_webhook()
         asyncio.create_task(check_employees())
-        await dp.start_polling(bot, skip_updates=True)
+        if LIVE_TRACKING:
+            asyncio.create_task(flush_live_tracks())
+        if BACKUP_INTERVAL > 0:
+            asyncio.create_task(backup_employees_db())
+        await dp.start_polling(bot, skip_updates=True, tasks_concurrency_limit=MAX_PENDING_UPDATES)
     except Exception as e:
         logging.error(f"Ошибка при запуске бота: {e}")
         raise
+    finally:
+        # Сохраняем точки трансляций, не успевшие попасть в базу
+        for user_id in list(live_tracks):
+            flush_live_track(user_id)
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    # Восстановление из бэкапа: python tripsbot.py --restore backups/employees-....db.gz
+    if len(sys.argv) == 3 and sys.argv[1] == '--restore':
+        restore_backup(sys.argv[2])
+        print(f"База данных восстановлена из {sys.argv[2]}")
+    else:
+        asyncio.run(main())